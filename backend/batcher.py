@@ -0,0 +1,33 @@
+import asyncio
+from typing import Any, Callable, Dict
+
+from .gemini_agent import GeminiAgent
+
+
+class PromptBatcher:
+    """Shares one Gemini call between callers asking the same prompt at once.
+
+    `await submit(prompt)` starts GeminiAgent.generate immediately; any caller
+    submitting the identical prompt while that call is still in flight awaits
+    the same result instead of issuing a second request.
+    """
+
+    def __init__(self, get_agent: Callable[[], GeminiAgent]):
+        self.get_agent = get_agent
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def submit(self, prompt: str) -> Dict[str, Any]:
+        """Return GeminiAgent.generate(prompt), joining an in-flight call for the same prompt."""
+        task = self._inflight.get(prompt)
+        if task is None:
+            task = asyncio.create_task(self.get_agent().generate(prompt))
+            self._inflight[prompt] = task
+            task.add_done_callback(lambda _: self._inflight.pop(prompt, None))
+        # Shield: one caller being cancelled must not cancel the others' call
+        return await asyncio.shield(task)
+
+    async def aclose(self) -> None:
+        """Cancel in-flight calls; the agent is owned (and closed) by the caller."""
+        for task in list(self._inflight.values()):
+            task.cancel()
+        self._inflight.clear()
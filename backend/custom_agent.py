@@ -1,5 +1,19 @@
+import asyncio
 import re
-from typing import Dict, Any, List
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+# Bump whenever _ADD_INTENT_PROMPT changes so cached classifications are not reused
+_INTENT_PROMPT_VERSION = 1
+_INTENT_CACHE_SIZE = 512
+
+_URL_RE = re.compile(r"https?://\S+")
+
+_ADD_INTENT_PROMPT = (
+    "O usuário pediu: \"{message}\".\n\n"
+    "A mensagem contém a solicitação para ADICIONAR a URL {url} ao repositório de conhecimento? "
+    "Responda apenas com SIM ou NÃO."
+)
 
 
 class CustomAgent:
@@ -8,20 +22,47 @@ class CustomAgent:
     The agent uses the MCP gemini wrapper to interpret the user's intent and
     calls the `mcp_tools.add_knowledge_url` tool to scrape and persist the page.
     """
-    def __init__(self):
-        try:
-            from .mcpo_tools import GeminiAgent
-            self.gemini = GeminiAgent()
-        except Exception:
-            self.gemini = None
+    def __init__(self, gemini: Optional[Any] = None):
+        # Reuse the caller's GeminiAgent (and its SDK client) when provided
+        self.gemini = gemini
+        if self.gemini is None:
+            try:
+                from .mcpo_tools import get_gemini
+                self.gemini = get_gemini()
+            except Exception:
+                self.gemini = None
+        # (prompt version, normalized message, url) -> "SIM"/"NAO"-style verdict
+        self._intent_cache: "OrderedDict[Tuple[int, str, str], str]" = OrderedDict()
 
     def _extract_first_url(self, text: str) -> str:
-        m = re.search(r"(https?://\S+)", text)
+        m = _URL_RE.search(text)
         if not m:
             return ""
-        url = m.group(1).rstrip('.,)')
+        url = m.group(0).rstrip('.,)')
         return url
 
+    async def _classify_add_intent(self, message: str, url: str) -> Optional[str]:
+        """Ask Gemini whether the message asks to add `url`; LRU-cached per normalized message."""
+        key = (_INTENT_PROMPT_VERSION, message.strip().lower(), url)
+        cached = self._intent_cache.get(key)
+        if cached is not None:
+            self._intent_cache.move_to_end(key)
+            return cached
+
+        try:
+            resp = await self.gemini.generate(_ADD_INTENT_PROMPT.format(message=message, url=url))
+        except Exception:
+            return None
+        if not isinstance(resp, dict) or not resp.get("text"):
+            return None
+
+        # Negative verdicts are cached too; only failed calls fall through uncached
+        verdict = resp["text"].strip().upper()
+        self._intent_cache[key] = verdict
+        if len(self._intent_cache) > _INTENT_CACHE_SIZE:
+            self._intent_cache.popitem(last=False)
+        return verdict
+
     async def handle_add_request(self, user_id: str, message: str) -> Dict[str, Any]:
         """If message contains a URL and the user intends to add it to knowledge,
         call the add_knowledge_url tool and return a friendly message.
@@ -33,25 +74,7 @@ class CustomAgent:
             return {"answer": "Não encontrei uma URL na mensagem.", "tools_used": tools_used}
 
         # Ask LLM whether this is a request to add the URL to the knowledge base
-        confirm = None
-        if self.gemini:
-            prompt = (
-                f"O usuário pediu: \"{message}\".\n\n" 
-                f"A mensagem contém a solicitação para ADICIONAR a URL {url} ao repositório de conhecimento? "
-                "Responda apenas com SIM ou NÃO."
-            )
-            try:
-                resp = await self.gemini.tool_gemini_generate({"prompt": prompt, "max_tokens": 100})
-                if isinstance(resp, dict) and "result" in resp:
-                    result = resp["result"]
-                    if isinstance(result, dict) and "candidates" in result:
-                        confirm = result["candidates"][0]["content"]["parts"][0]["text"].strip().upper()
-                    else:
-                        confirm = None
-                else:
-                    confirm = None
-            except Exception:
-                confirm = None
+        confirm = await self._classify_add_intent(message, url) if self.gemini else None
 
         # fallback heuristic if LLM not available or ambiguous
         if not confirm:
@@ -65,7 +88,7 @@ class CustomAgent:
             # perform the add via mcp_tools
             try:
                 from .mcpo_tools import add_knowledge_url_tool
-                entry = add_knowledge_url_tool({"url": url})
+                entry = await asyncio.to_thread(add_knowledge_url_tool, {"url": url})
                 tools_used.append("add_knowledge_url")
                 return {"answer": f"URL adicionada ao knowledge: {url}", "tools_used": tools_used, "entry": entry}
             except Exception as e:
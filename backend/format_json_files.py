@@ -0,0 +1,40 @@
+"""Pretty-print the JSON files in backend/data for manual inspection/editing.
+
+Usage: python -m backend.format_json_files [file.json ...]
+
+Files that are missing or fail to parse are reported and left untouched.
+"""
+import sys
+from pathlib import Path
+
+import orjson
+
+from .mcpo_tools import DATA_DIR, _write_json
+
+
+def main(paths) -> int:
+    failed = 0
+    for path in paths or sorted(DATA_DIR.glob("*.json")):
+        path = Path(path)
+        # Parse directly: _read_json maps any error to {}, which would overwrite the file
+        try:
+            raw = path.read_bytes()
+            data = orjson.loads(raw)
+        except FileNotFoundError:
+            print(f"skipped {path}: no such file")
+            failed += 1
+            continue
+        except orjson.JSONDecodeError as e:
+            print(f"skipped {path}: invalid JSON ({e})")
+            failed += 1
+            continue
+        if raw == orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS):
+            print(f"unchanged {path}")
+            continue
+        _write_json(path, data, pretty=True)
+        print(f"formatted {path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,59 +1,78 @@
 from google import genai
 import os
 import asyncio
-import time
-from typing import Dict, Any, Type
+from typing import Dict, Any, Optional, Type
 from pydantic import BaseModel, ValidationError
-import json
+import orjson
 import re
 import random
 
+# Optional ```json fence around the model's JSON payload
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.S)
+# Python-style boolean literals the model sometimes emits inside JSON
+_BOOL_RE = re.compile(r"\b(True|False)\b")
+# Gemini 429 bodies carry a google.rpc.RetryInfo detail such as 'retryDelay': '13s'
+_RETRY_DELAY_RE = re.compile(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s")
+
 
 class GeminiAgent:
     """Lightweight Gemini wrapper with retry and structured generation."""
 
-    def __init__(self, max_retries: int = 5, base_delay: float = 2.0):
+    def __init__(self, max_retries: int = 5, base_delay: float = 2.0, max_delay: float = 30.0):
         self.api_key = os.environ.get("GEMINI_API_KEY", "")
         self.model = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash-lite")
         self.max_retries = max_retries
         self.base_delay = base_delay  # seconds
-
-    def _close_client_async(self, client: Any) -> None:
-        """Attempt to close the client cleanly."""
+        self.max_delay = max_delay  # cap for the backoff window, seconds
+        self._client = None
+
+    def _get_client(self) -> Any:
+        """Return the shared client, creating it on first use."""
+        if self._client is None:
+            self._client = genai.Client(api_key=self.api_key)
+        return self._client
+
+    async def aclose(self) -> None:
+        """Release the shared client (sync and async transports), if one was created."""
+        client, self._client = self._client, None
+        if client is None:
+            return
         try:
-            aclose = getattr(client, "aclose", None)
-            close = getattr(client, "close", None)
-            loop = None
-            try:
-                loop = asyncio.get_running_loop()
-            except RuntimeError:
-                loop = None
-
-            if aclose and loop is not None:
-                loop.create_task(aclose())
-                return
-
-            if close:
-                close()
+            await client.aio.aclose()
+            client.close()
         except Exception:
             pass
 
-    def _retry_logic(self, attempt: int) -> None:
-        """Wait with exponential backoff + jitter before retrying."""
-        delay = self.base_delay * (2 ** (attempt - 1)) + random.uniform(0, 0.5)
+    def _retry_after(self, error: Optional[Exception]) -> float:
+        """Server-suggested wait in seconds (Retry-After header or RetryInfo), or 0."""
+        if error is None:
+            return 0.0
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        retry_after = headers.get("retry-after") if headers is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except (TypeError, ValueError):
+                pass
+        m = _RETRY_DELAY_RE.search(str(error))
+        return float(m.group(1)) if m else 0.0
+
+    async def _retry_logic(self, attempt: int, error: Optional[Exception] = None) -> None:
+        """Wait with full-jitter exponential backoff, honoring any server retry hint."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        delay = max(delay, self._retry_after(error))
         print(f"⚠️ Tentativa {attempt} falhou, aguardando {delay:.2f}s antes de tentar novamente...")
-        time.sleep(delay)
+        await asyncio.sleep(delay)
 
-    def generate(self, message: str) -> Dict[str, Any]:
+    async def generate(self, message: str) -> Dict[str, Any]:
         """Generate a raw text response from Gemini with retry support."""
         attempt = 0
 
         while attempt < self.max_retries:
             attempt += 1
-            client = None
             try:
-                client = genai.Client(api_key=self.api_key)
-                response = client.models.generate_content(
+                client = self._get_client()
+                response = await client.aio.models.generate_content(
                     model=self.model,
                     contents=message,
                 )
@@ -63,7 +82,7 @@ class GeminiAgent:
             except Exception as e:
                 if "429" in str(e):
                     if attempt < self.max_retries:
-                        self._retry_logic(attempt)
+                        await self._retry_logic(attempt, e)
                         continue
                     else:
                         return {
@@ -77,41 +96,30 @@ class GeminiAgent:
                         "error": str(e),
                     }
 
-            finally:
-                if client is not None:
-                    self._close_client_async(client)
-
         return {"error": "Max retries exceeded.", "model": self.model}
 
-    def generate_structured(self, message: str, response_model: Type[BaseModel]):
+    async def generate_structured(self, message: str, response_model: Type[BaseModel]):
         """Generate a structured (typed) response using Gemini with retry support."""
         attempt = 0
 
         while attempt < self.max_retries:
             attempt += 1
-            client = None
             try:
-                client = genai.Client(api_key=self.api_key)
-                response = client.models.generate_content(
+                client = self._get_client()
+                response = await client.aio.models.generate_content(
                     model=self.model,
                     contents=message,
                 )
                 text = getattr(response, "text", None) or str(response)
 
-                cleaned = (
-                    text.strip()
-                    .replace("```json", "")
-                    .replace("```", "")
-                    .strip()
-                )
-
-                normalized = re.sub(r'\bFalse\b', 'false', cleaned)
-                normalized = re.sub(r'\bTrue\b', 'true', normalized)
+                fenced = _FENCE_RE.match(text)
+                cleaned = fenced.group(1) if fenced else text
+                normalized = _BOOL_RE.sub(lambda m: m.group(1).lower(), cleaned)
 
                 try:
-                    data = json.loads(normalized)
+                    data = orjson.loads(normalized)
                     return response_model(**data)
-                except (json.JSONDecodeError, ValidationError) as e:
+                except (orjson.JSONDecodeError, ValidationError) as e:
                     return {
                         "error": f"Invalid model output: {e}",
                         "raw_text": text,
@@ -121,7 +129,7 @@ class GeminiAgent:
             except Exception as e:
                 if "429" in str(e):
                     if attempt < self.max_retries:
-                        self._retry_logic(attempt)
+                        await self._retry_logic(attempt, e)
                         continue
                     else:
                         return {
@@ -131,8 +139,4 @@ class GeminiAgent:
                 else:
                     return {"error": str(e), "model": self.model}
 
-            finally:
-                if client is not None:
-                    self._close_client_async(client)
-
         return {"error": "Max retries exceeded.", "model": self.model}
@@ -1,79 +1,159 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 from fastapi import HTTPException
 from .mcp_client import MCPClient
+from collections import OrderedDict
 import asyncio
+import numpy as np
+import scipy.sparse as sp
+import re
+from pathlib import Path
+import diskcache
+
+# A sentence starts at a non-space, non-period character and runs through its period
+_SENTENCE_RE = re.compile(r"[^.\s][^.]*\.?")
+
+# Fetched+chunked pages, shared across workers and restarts
+PAGE_CACHE_DIR = Path(__file__).resolve().parent / ".cache" / "kb"
+PAGE_CACHE_TTL = 24 * 60 * 60  # seconds
+_page_cache = None
+
+
+def _get_page_cache() -> diskcache.Cache:
+    global _page_cache
+    if _page_cache is None:
+        _page_cache = diskcache.Cache(str(PAGE_CACHE_DIR))
+    return _page_cache
+
+
+def _quantize_rows(matrix) -> Tuple[sp.csc_matrix, np.ndarray]:
+    """Quantize a sparse non-negative matrix to int8 with one float32 scale per row.
+
+    Returned column-major so a query only touches the columns of its own terms.
+    """
+    csr = sp.csr_matrix(matrix, dtype=np.float32)
+    scales = (abs(csr).max(axis=1).toarray().ravel() / 127.0).astype(np.float32)
+    scales[scales == 0] = 1.0
+    data = np.rint(csr.data / np.repeat(scales, np.diff(csr.indptr))).astype(np.int8)
+    quantized = sp.csr_matrix((data, csr.indices, csr.indptr), shape=csr.shape)
+    return quantized.tocsc(), scales
 
 
 class KnowledgeAgent:
 
-    def __init__(self):
+    def __init__(self, seed_urls: Optional[List[str]] = None):
+        # Static pages always indexed, merged with knowledge.json at build time
+        # (url -> stored summary; seeds have none)
+        self._seed_knowledge: Dict[str, str] = dict.fromkeys(seed_urls or (), "")
         # docs will be list of (text_chunk, source_url)
         self.docs = []
+        # TF-IDF space fitted once per index build; rows are L2-normalized and
+        # stored as int8 (CSC) with a per-row dequantization scale
+        self._vectorizer = None
+        self._doc_emb_i8 = None
+        self._doc_scales = None
         self._indexed = False
-        
+        # (normalized query, top_k) -> hits, cleared whenever the index is rebuilt
+        self._retrieve_cache: "OrderedDict[Tuple[str, int], List[Tuple[str, str, float]]]" = OrderedDict()
+        self._retrieve_cache_size = 256
+        # Serializes concurrent rebuilds
+        self._build_lock = asyncio.Lock()
 
-    def _fetch_text(self, url: str) -> str:
-        """Fetch and extract clean text from a webpage using MCP fetch_webpage."""
-        try:
-            from .mcpo_tools import fetch_webpage_tool
-            result = fetch_webpage_tool({"urls": [url]})
-            if not result or not result.get("content"):
-                return ""
-            return result["content"]
-        except Exception as e:
-            print(f"Error fetching {url}: {e}")
-            return ""
+    async def _fetch_chunks(self, urls: List[str]) -> Dict[str, List[str]]:
+        """Chunks per url, served from the on-disk page cache while fresh.
+
+        Only the urls missing from the cache are downloaded, all in one
+        concurrent batch.
+        """
+        # diskcache is synchronous SQLite: do lookups and stores in a worker thread
+        chunks_by_url = await asyncio.to_thread(self._cached_chunks, urls)
+        missing = [url for url in urls if url not in chunks_by_url]
+
+        if missing:
+            from .mcpo_tools import fetch_webpages
+            fresh: Dict[str, List[str]] = {}
+            for url, result in zip(missing, await fetch_webpages(missing)):
+                if result.get("error"):
+                    print(f"Error fetching {url}: {result['error']}")
+                text = result.get("content") or ""
+                if text:
+                    fresh[url] = self._chunk_text(text)
+            if fresh:
+                await asyncio.to_thread(self._store_chunks, fresh)
+                chunks_by_url.update(fresh)
+
+        return chunks_by_url
+
+    @staticmethod
+    def _cached_chunks(urls: List[str]) -> Dict[str, List[str]]:
+        cache = _get_page_cache()
+        found = {}
+        for url in urls:
+            chunks = cache.get(url)
+            if chunks is not None:
+                found[url] = chunks
+        return found
+
+    @staticmethod
+    def _store_chunks(chunks_by_url: Dict[str, List[str]]) -> None:
+        cache = _get_page_cache()
+        for url, chunks in chunks_by_url.items():
+            cache.set(url, chunks, expire=PAGE_CACHE_TTL)
 
     def _chunk_text(self, text: str, max_chars: int = 800) -> List[str]:
-        """Split text into chunks around sentence boundaries."""
-        sentences = text.split('.')
+        """Split text into chunks around sentence boundaries.
+
+        Chunks are slices of the original text, so no per-sentence strings
+        are built or re-joined.
+        """
         chunks = []
-        current_chunk = []
-        current_length = 0
-        
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-                
-            sentence_length = len(sentence)
-            
-            if current_length + sentence_length > max_chars and current_chunk:
-                chunks.append(". ".join(current_chunk) + ".")
-                current_chunk = [sentence]
-                current_length = sentence_length
-            else:
-                current_chunk.append(sentence)
-                current_length += sentence_length
-                
-        if current_chunk:
-            chunks.append(". ".join(current_chunk) + ".")
-            
+        start = end = -1
+
+        for m in _SENTENCE_RE.finditer(text):
+            if start < 0:
+                start = m.start()
+            elif m.end() - start > max_chars:
+                chunks.append(text[start:end])
+                start = m.start()
+            end = m.end()
+
+        if start >= 0:
+            chunks.append(text[start:end])
+
         return chunks
 
-    def build_index(self):
-        """Download pages and build index using MCP fetch_webpage."""
+    async def build_index(self):
+        """Download pages and build index using MCP fetch_webpages."""
         if self._indexed:
             return
+        async with self._build_lock:
+            # Another request may have finished the build while we waited
+            if not self._indexed:
+                await self._build()
+
+    async def _build(self):
+        self._retrieve_cache.clear()
 
         # Load known URLs from knowledge.json via MCP tools
         try:
             from .mcpo_tools import get_knowledge_tool
-            knowledge = get_knowledge_tool()
+            stored = await asyncio.to_thread(get_knowledge_tool)
         except Exception:
-            knowledge = {}
+            stored = {}
+        # Seed URLs first; stored entries override them with their summaries
+        knowledge = {**self._seed_knowledge, **stored}
+
+        # Pages come from independent origins: fetch them concurrently
+        fetched = await self._fetch_chunks(list(knowledge))
 
         all_chunks = []
         for url, stored_summary in knowledge.items():
-            text = self._fetch_text(url)
-            # if fetch fails, fall back to stored summary
-            if not text:
-                text = stored_summary or ""
-            if not text:
+            chunks = fetched.get(url)
+            # if fetch fails, fall back to the chunked stored summary
+            if not chunks:
+                chunks = self._chunk_text(stored_summary or "")
+            if not chunks:
                 continue
 
-            # Chunk the fetched text (or stored summary when fetch failed)
-            chunks = self._chunk_text(text)
             for c in chunks:
                 all_chunks.append((c, url))
 
@@ -86,75 +166,85 @@ class KnowledgeAgent:
             except Exception:
                 pass
 
-        if not all_chunks:
-            self.docs = []
-            self._indexed = True
-            return
+        self._vectorizer = None
+        self._doc_emb_i8 = None
+        self._doc_scales = None
+        if all_chunks:
+            from .mcpo_tools import embed_documents_tool
+            # Fitting TF-IDF is CPU-bound; keep it off the event loop
+            embedded = await asyncio.to_thread(
+                embed_documents_tool, {"documents": [text for text, _ in all_chunks]}
+            )
+            if "error" in embedded:
+                print(f"Error embedding documents: {embedded['error']}")
+            else:
+                self._vectorizer = embedded["vectorizer"]
+                self._doc_emb_i8, self._doc_scales = _quantize_rows(embedded["embeddings"])
 
         self.docs = all_chunks
         self._indexed = True
 
-    def retrieve(self, query: str, top_k: int = 3) -> List[Tuple[str, str, float]]:
-        """Return top_k (text, source_url, score) tuples relevant to query using MCP semantic search."""
+    async def retrieve(self, query: str, top_k: int = 3) -> List[Tuple[str, str, float]]:
+        """Return top_k (text, source_url, score) tuples relevant to query.
+
+        Only the query is vectorized per call; it is scored against the int8
+        document matrix built in build_index (cosine, as rows are L2-normalized),
+        reading just the columns of the terms present in the query.
+        """
         if not self._indexed:
-            self.build_index()
-        if not self.docs:
+            await self.build_index()
+        if not self.docs or self._doc_emb_i8 is None:
             return []
 
+        key = (query.strip().lower(), top_k)
+        cached = self._retrieve_cache.get(key)
+        if cached is not None:
+            self._retrieve_cache.move_to_end(key)
+            return cached
+
         try:
-            from .mcpo_tools import semantic_search_tool
-            texts = [text for text, _ in self.docs]
-            
-            payload = {
-                "query": query,
-                "documents": texts,
-                "top_k": top_k
-            }
-            results = semantic_search_tool(payload)
-            if not results:
+            qv = self._vectorizer.transform([query])
+            if qv.nnz == 0:
                 return []
+            scores = (self._doc_emb_i8[:, qv.indices] @ qv.data) * self._doc_scales
 
-            hits = []
-            for res in results:
-                if "error" in res:
-                    print(f"Error in search result: {res['error']}")
-                    continue
-                idx = int(res.get("index", -1))
-                if idx < 0 or idx >= len(texts):
-                    continue
-                text = texts[idx]
-                url = next((url for t, url in self.docs if t == text), "")
-                score = float(res.get("score", 0.0))
-                hits.append((text, url, score))
-
-            return hits
+            k = min(top_k, scores.size)
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
 
+            hits = []
+            for idx in top:
+                text, url = self.docs[idx]
+                hits.append((text, url, float(scores[idx])))
         except Exception as e:
             print(f"Error in retrieve: {e}")
             return []
 
+        # Empty results are cached as well: unanswerable queries tend to repeat
+        self._retrieve_cache[key] = hits
+        if len(self._retrieve_cache) > self._retrieve_cache_size:
+            self._retrieve_cache.popitem(last=False)
+        return hits
+
     async def answer(self, query: str) -> Dict[str, Any]:
         """Answer a question using retrieved passages via MCP Gemini Flash."""
         try:
-            hits = self.retrieve(query, top_k=3)
+            hits = await self.retrieve(query, top_k=3)
             if not hits:
                 return {
                     "answer": "I couldn't find enough information to answer.",
                     "sources": []
                 }
 
-            texts = []
-            sources = set()
-            for text, url, score in hits:
-                if score < 0.1:
-                    continue
-                texts.append(text)
-                sources.add(url)
-
-            if not texts:
+            # hits are sorted by score, so a sub-threshold best hit means none pass
+            if hits[0][2] < 0.1:
                 return {"answer": "No relevant information found.", "sources": []}
 
-            context = "\n\n".join(texts)
+            relevant = [(text, url) for text, url, score in hits if score >= 0.1]
+            context = "\n\n".join(text for text, _ in relevant)
+            sources = {url for _, url in relevant}
             prompt = (
                 f"Based on this context, answer the question below in a direct and technical manner:\n\n"
                 f"Question: {query}\n\n"
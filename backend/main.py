@@ -1,5 +1,6 @@
-from fastapi import FastAPI, HTTPException, Request
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from typing import Optional, List
 from .knowledge_agent import KnowledgeAgent
 from .router_agent import RouterAgent
@@ -8,13 +9,32 @@ from .custom_agent import CustomAgent
 from dotenv import load_dotenv
 import httpx
 import os
-from .gemini_agent import GeminiAgent
+import asyncio
+import orjson
+from contextlib import asynccontextmanager
 from .models import LLMDecision
-from .mcpo_tools import MCP_TOOLS, TOOLS
+from .mcpo_tools import MCP_TOOLS, TOOLS, GEMINI_BATCHER, get_gemini
 
 load_dotenv()
 
-app = FastAPI(title="Agent API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build in the background so slow page fetches don't delay readiness;
+    # requests arriving meanwhile wait on the agent's build lock
+    app.state.knowledge_warmup = asyncio.create_task(knowledge_agent.build_index())
+    try:
+        yield
+    finally:
+        warmup = getattr(app.state, "knowledge_warmup", None)
+        if warmup is not None:
+            warmup.cancel()
+        try:
+            await GEMINI_BATCHER.aclose()
+            await gemini_agent.aclose()
+        finally:
+            await router_agent.mcp_client.aclose()
+
+app = FastAPI(title="Agent API", lifespan=lifespan)
 
 INFINITEPAY_PAGES = [
     "https://www.infinitepay.io",
@@ -37,10 +57,12 @@ INFINITEPAY_PAGES = [
     "https://www.infinitepay.io/rendimento",
 ]
 
-knowledge_agent = KnowledgeAgent()
-support_agent = SupportAgent()
-custom_agent = CustomAgent()
-router_agent = RouterAgent(knowledge_agent, support_agent, custom_agent)
+# The process-wide GeminiAgent (and so one SDK client) shared by every agent and tool
+gemini_agent = get_gemini()
+knowledge_agent = KnowledgeAgent(seed_urls=INFINITEPAY_PAGES)
+support_agent = SupportAgent(gemini=gemini_agent)
+custom_agent = CustomAgent(gemini=gemini_agent)
+router_agent = RouterAgent(knowledge_agent, support_agent, custom_agent, gemini_agent=gemini_agent)
 
 class SwarmRequest(BaseModel):
     message: str
@@ -55,7 +77,7 @@ class SwarmResponse(BaseModel):
 
 class MCPInvokeRequest(BaseModel):
     tool_id: str
-    parameters: dict
+    parameters: dict = Field(default_factory=dict)
 
 @app.post("/swarm", response_model=SwarmResponse)
 async def swarm_chat(req: SwarmRequest):
@@ -71,14 +93,75 @@ async def swarm_chat(req: SwarmRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _swarm_events(req: SwarmRequest):
+    """Events for one /swarm turn: status per routing step, the answer as delta, then done (or error)."""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def on_step(text: str) -> None:
+        await queue.put({"type": "status", "text": text})
+
+    task = asyncio.create_task(
+        router_agent.route_and_respond(req.message, user_id=req.user_id, on_step=on_step)
+    )
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+
+        result = task.result()
+        yield {"type": "delta", "text": result["answer"]}
+        yield {
+            "type": "done",
+            "sources": result["sources"],
+            "used_retrieval": result["used_retrieval"],
+            "user_id": req.user_id,
+            "tools_used": result.get("tools_used"),
+        }
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
+    finally:
+        # Client went away mid-answer: stop the routing work too
+        task.cancel()
+
+def _sse(event: dict) -> bytes:
+    return b"data: " + orjson.dumps(event) + b"\n\n"
+
+@app.post("/swarm/stream")
+async def swarm_chat_stream(req: SwarmRequest):
+    """Server-sent events for /swarm (see _swarm_events)."""
+    async def events():
+        async for event in _swarm_events(req):
+            yield _sse(event)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.websocket("/swarm/ws")
+async def swarm_chat_ws(ws: WebSocket):
+    """Persistent chat socket: each {"message", "user_id"} frame gets the /swarm/stream events back."""
+    await ws.accept()
+    try:
+        while True:
+            frame = await ws.receive()
+            if frame["type"] == "websocket.disconnect":
+                break
+            try:
+                req = SwarmRequest.model_validate(orjson.loads(frame.get("bytes") or frame.get("text") or b""))
+            except (orjson.JSONDecodeError, ValidationError) as e:
+                await ws.send_bytes(orjson.dumps({"type": "error", "error": str(e)}))
+                continue
+            async for event in _swarm_events(req):
+                await ws.send_bytes(orjson.dumps(event))
+    except WebSocketDisconnect:
+        pass
+
 @app.post("/mcp/invoke")
 async def invoke_tool(request: MCPInvokeRequest):
-    tool_id = request.tool_id
-    params = request.parameters or {}
-
-    if tool_id not in TOOLS:
-        return {"error": f"Tool '{tool_id}' not recognized."}
+    func = TOOLS.get(request.tool_id)
+    if func is None:
+        return {"error": f"Tool '{request.tool_id}' not recognized."}
 
-    func = TOOLS[tool_id]
-    return await func(params)
+    return await func(request.parameters)
 
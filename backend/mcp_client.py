@@ -1,5 +1,7 @@
 import os
+from typing import Optional
 import httpx
+import orjson
 
 MCP_BASE_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
@@ -8,19 +10,35 @@ class MCPClient:
 
     def __init__(self, base_url: str = MCP_BASE_URL):
         self.base_url = base_url.rstrip("/")
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Cliente HTTP compartilhado (keep-alive), criado no primeiro uso."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            )
+        return self._client
+
+    async def aclose(self):
+        """Fecha o pool de conexões compartilhado."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def invoke_tool(self, tool_id: str, parameters: dict):
         """Invoca uma ferramenta registrada no servidor MCP."""
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{self.base_url}/mcp/invoke",
-                    json={"tool_id": tool_id, "parameters": parameters},
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                return response.json()
-            except httpx.RequestError as e:
-                return {"error": f"Erro de rede: {e}"}
-            except httpx.HTTPStatusError as e:
-                return {"error": f"Erro HTTP: {e.response.status_code} - {e.response.text}"}
+        try:
+            response = await self._get_client().post(
+                "/mcp/invoke",
+                content=orjson.dumps({"tool_id": tool_id, "parameters": parameters}),
+                headers={"Content-Type": "application/json"},
+            )
+            response.raise_for_status()
+            return response.json()
+        except httpx.RequestError as e:
+            return {"error": f"Erro de rede: {e}"}
+        except httpx.HTTPStatusError as e:
+            return {"error": f"Erro HTTP: {e.response.status_code} - {e.response.text}"}
@@ -1,19 +1,25 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Union
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 from pathlib import Path
 from pydantic import BaseModel
-import json
+import mmap
+import pickle
+import orjson
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer
+from sklearn.pipeline import Pipeline, make_pipeline
 import re
-import os
 import httpx
 import asyncio
-from typing import Dict, Any
-from pydantic import BaseModel
+import functools
+import threading
 from .knowledge_agent import KnowledgeAgent
 from .gemini_agent import GeminiAgent
+from .batcher import PromptBatcher
 from .models import LLMDecision
 
 # ---------------------------
@@ -23,26 +29,115 @@ DATA_DIR = Path(__file__).resolve().parent / "data"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 USERS_FILE = DATA_DIR / "users.json"
 MESSAGES_FILE = DATA_DIR / "messages.json"
-TICKETS_FILE = DATA_DIR / "tickets.json"
+TICKETS_FILE = DATA_DIR / "tickets.ndjson"  # one ticket per line, append-only
+LEGACY_TICKETS_FILE = DATA_DIR / "tickets.json"  # {"tickets": [...]}, imported once into TICKETS_FILE
 KNOWLEDGE_FILE = DATA_DIR / "knowledge.json"
+# Índice TF-IDF derivado do knowledge.json (vectorizer + ids em pickle, matriz em npz)
+KNOWLEDGE_INDEX_FILE = DATA_DIR / "knowledge.idx"
+KNOWLEDGE_MATRIX_FILE = DATA_DIR / "knowledge.npz"
+
+# ---------------------------
+# Sessão HTTP compartilhada (keep-alive + pool por host)
+# ---------------------------
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+)
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
 
 # ---------------------------
 # Funções utilitárias
 # ---------------------------
+_WS_RE = re.compile(r"\s+")
+_SENT_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Files at least this big are parsed straight from a read-only mmap (no extra copy)
+_MMAP_THRESHOLD = 1 << 20
+
+# path -> ((st_mtime_ns, st_size), parsed data); re-parsed whenever the file changes
+_CACHE: Dict[Path, Tuple[Tuple[int, int], Any]] = {}
+
 def _read_json(path: Path) -> Dict[str, Any]:
+    """Parsed contents of path, cached until its mtime/size change.
+
+    The returned object is shared between callers: mutate it only right
+    before persisting it with _write_json.
+    """
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
+        st = path.stat()
+        key = (st.st_mtime_ns, st.st_size)
+        entry = _CACHE.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        if st.st_size < _MMAP_THRESHOLD:
+            data = orjson.loads(path.read_bytes())
+        else:
+            with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    data = orjson.loads(view)
     except Exception:
         return {}
 
-def _write_json(path: Path, data: Dict[str, Any]):
+    _CACHE[path] = (key, data)
+    return data
+
+def _write_json(path: Path, data: Dict[str, Any], pretty: bool = False):
+    """Atomically persist data; compact unless pretty (for human-edited files)."""
+    option = orjson.OPT_NON_STR_KEYS
+    if pretty:
+        option |= orjson.OPT_INDENT_2
     tmp = path.with_suffix(path.suffix + ".tmp")
-    tmp.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+    tmp.write_bytes(orjson.dumps(data, option=option))
     tmp.replace(path)
+    st = path.stat()
+    _CACHE[path] = ((st.st_mtime_ns, st.st_size), data)
+
+# path -> ((st_mtime_ns, st_size), number of records)
+_LINE_COUNTS: Dict[Path, Tuple[Tuple[int, int], int]] = {}
+_APPEND_LOCK = threading.Lock()
+
+def _ndjson_count(path: Path) -> int:
+    """Number of records in an NDJSON file, recounted only when the file changes."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return 0
+    key = (st.st_mtime_ns, st.st_size)
+    entry = _LINE_COUNTS.get(path)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+
+    with path.open("rb") as f:
+        count = sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 16), b""))
+    _LINE_COUNTS[path] = (key, count)
+    return count
+
+def _append_ndjson(path: Path, record: Dict[str, Any]) -> None:
+    """Append one record as a JSON line: O(record) I/O instead of rewriting the file."""
+    count = _ndjson_count(path)
+    with path.open("ab") as f:
+        f.write(orjson.dumps(record) + b"\n")
+    st = path.stat()
+    _LINE_COUNTS[path] = ((st.st_mtime_ns, st.st_size), count + 1)
 
 # ---------------------------
 # Tools principais
 # ---------------------------
+def _extract_page(content: bytes, url: str) -> Dict[str, Any]:
+    """Parse raw HTML into clean text + title."""
+    # lxml is much faster than html.parser; raw bytes let it honour the page's charset
+    soup = BeautifulSoup(content, "lxml")
+    for s in soup(["script", "style", "noscript"]):
+        s.decompose()
+
+    title = soup.title.string.strip() if soup.title and soup.title.string else ""
+    text = _WS_RE.sub(" ", soup.get_text(separator=" \n ")).strip()
+    return {"content": text, "url": url, "title": title}
+
 def fetch_webpage_tool(payload: Dict[str, Any]) -> Dict[str, Any]:
     """Fetch the first URL and return content + metadata."""
     urls = payload.get("urls", [])
@@ -51,34 +146,202 @@ def fetch_webpage_tool(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     url = urls[0]
     try:
-        r = requests.get(url, timeout=10)
+        r = _SESSION.get(url, timeout=10)
         r.raise_for_status()
-        soup = BeautifulSoup(r.text, "html.parser")
-        for s in soup(["script", "style", "noscript"]):
-            s.decompose()
+        return _extract_page(r.content, url)
+    except Exception as e:
+        return {"error": str(e)}
+
+async def fetch_webpages(urls: List[str]) -> List[Dict[str, Any]]:
+    """Fetch every URL concurrently; one result per URL, in order.
+
+    Each result has the same shape as fetch_webpage_tool's (including
+    {"error": ...} on failure). HTML parsing runs in worker threads.
+    """
+    if not urls:
+        return []
+
+    limits = httpx.Limits(max_connections=20, max_keepalive_connections=20)
+    async with httpx.AsyncClient(timeout=10, limits=limits, follow_redirects=True) as client:
+        responses = await asyncio.gather(*(client.get(u) for u in urls), return_exceptions=True)
+
+    async def _parse(url: str, resp: Any) -> Dict[str, Any]:
+        try:
+            if isinstance(resp, BaseException):
+                raise resp
+            resp.raise_for_status()
+            return await asyncio.to_thread(_extract_page, resp.content, url)
+        except Exception as e:
+            return {"error": str(e), "url": url}
+
+    return list(await asyncio.gather(*(_parse(u, r) for u, r in zip(urls, responses))))
+
+# English stop words + word uni/bigrams, i.e. what the vectorizers used to build themselves
+_WORD_ANALYZER = TfidfVectorizer(stop_words="english", ngram_range=(1, 2)).build_analyzer()
+
+@functools.lru_cache(maxsize=4096)
+def _analyze(doc: str) -> Tuple[str, ...]:
+    """Tokens of doc, memoized: corpora and queries are re-vectorized far more often than they change.
+
+    Module-level (not a closure) so fitted vectorizers stay picklable.
+    """
+    return tuple(_WORD_ANALYZER(doc))
+
+# Below this many documents, hashing skips building (and storing) a vocabulary
+_HASHING_MAX_DOCS = 64
+
+def _make_vectorizer(n_docs: int) -> Union[TfidfVectorizer, Pipeline]:
+    """TF-IDF vectorizer sized for a corpus of n_docs; both kinds expose fit_transform/transform."""
+    if n_docs < _HASHING_MAX_DOCS:
+        return make_pipeline(
+            HashingVectorizer(
+                n_features=2 ** 14,
+                alternate_sign=False,
+                norm=None,
+                analyzer=_analyze,
+                dtype=np.float32,
+            ),
+            TfidfTransformer(sublinear_tf=True),
+        )
+    # float32 is plenty for ranking and halves the matrix; sublinear tf damps repeated terms
+    return TfidfVectorizer(max_features=10000, analyzer=_analyze, dtype=np.float32, sublinear_tf=True)
+
+@functools.lru_cache(maxsize=16)
+def _fit_corpus(documents: Tuple[str, ...]):
+    """Fitted (vectorizer, doc matrix) per corpus; repeated searches only transform the query.
+
+    The matrix is kept column-major (CSC) so scoring can read just the query's terms.
+    """
+    vectorizer = _make_vectorizer(len(documents))
+    return vectorizer, vectorizer.fit_transform(documents).tocsc()
+
+def embed_documents_tool(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Fit the TF-IDF space over a corpus once.
+
+    Returns the fitted vectorizer and the sparse (n_docs, n_features) matrix so
+    callers can vectorize only their queries afterwards (in-process use only).
+    """
+    documents = payload.get("documents", [])
+    if not documents:
+        return {"error": "No documents provided."}
 
-        title = soup.title.string.strip() if soup.title and soup.title.string else ""
-        text = re.sub(r"\s+", " ", soup.get_text(separator=" \n ")).strip()
-        return {"content": text, "url": url, "title": title}
+    try:
+        vectorizer = _make_vectorizer(len(documents))
+        return {"vectorizer": vectorizer, "embeddings": vectorizer.fit_transform(documents)}
     except Exception as e:
         return {"error": str(e)}
 
+def _top_k(vectorizer, doc_vecs, query: str, top_k: int) -> List[Tuple[int, float]]:
+    """(row, score) of the top_k rows of doc_vecs for query, best first."""
+    qv = vectorizer.transform([query])
+    if qv.nnz == 0:
+        # Only stop words / unseen terms: every score would be 0
+        return []
+    # Only the query's nonzero term columns contribute to the dot products
+    scores = doc_vecs[:, qv.indices] @ qv.data
+
+    # O(N) partition for the top-k, then sort only those k
+    k = min(top_k, scores.size)
+    if k <= 0:
+        return []
+    part = np.argpartition(-scores, k - 1)[:k]
+    idxs = part[np.argsort(-scores[part])]
+    return [(int(i), float(scores[i])) for i in idxs]
+
+class KnowledgeIndex:
+    """Persistent TF-IDF index over the knowledge.json summaries.
+
+    Rebuilt only when knowledge.json changes (add_knowledge_url rebuilds it
+    eagerly); searches just transform the query.
+    """
+
+    def __init__(self, source_key: Tuple[int, int], vectorizer, doc_matrix, doc_ids: List[str]):
+        self.source_key = source_key  # (st_mtime_ns, st_size) of the knowledge.json it indexes
+        self.vectorizer = vectorizer
+        self.doc_matrix = doc_matrix  # CSC, one row per doc_id
+        self.doc_ids = doc_ids
+
+    @classmethod
+    def build(cls) -> Optional["KnowledgeIndex"]:
+        st = KNOWLEDGE_FILE.stat()
+        knowledge = get_knowledge_tool()
+        doc_ids = [url for url, summary in knowledge.items() if summary]
+        if not doc_ids:
+            return None
+        vectorizer = _make_vectorizer(len(doc_ids))
+        matrix = vectorizer.fit_transform([knowledge[url] for url in doc_ids]).tocsc()
+        return cls((st.st_mtime_ns, st.st_size), vectorizer, matrix, doc_ids)
+
+    def save(self) -> None:
+        sp.save_npz(KNOWLEDGE_MATRIX_FILE, self.doc_matrix)
+        with KNOWLEDGE_INDEX_FILE.open("wb") as f:
+            pickle.dump((self.source_key, self.vectorizer, self.doc_ids), f)
+
+    @classmethod
+    def load(cls) -> "KnowledgeIndex":
+        with KNOWLEDGE_INDEX_FILE.open("rb") as f:
+            source_key, vectorizer, doc_ids = pickle.load(f)
+        return cls(source_key, vectorizer, sp.load_npz(KNOWLEDGE_MATRIX_FILE).tocsc(), doc_ids)
+
+    def search(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        return [
+            {"index": i, "score": score, "url": self.doc_ids[i]}
+            for i, score in _top_k(self.vectorizer, self.doc_matrix, query, top_k)
+        ]
+
+_KNOWLEDGE_INDEX: Optional[KnowledgeIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+def _rebuild_knowledge_index() -> Optional[KnowledgeIndex]:
+    global _KNOWLEDGE_INDEX
+    index = KnowledgeIndex.build()
+    if index is not None:
+        index.save()
+    _KNOWLEDGE_INDEX = index
+    return index
+
+def _knowledge_index() -> Optional[KnowledgeIndex]:
+    """The knowledge index for the current knowledge.json: memory, then disk, then rebuilt."""
+    global _KNOWLEDGE_INDEX
+    try:
+        st = KNOWLEDGE_FILE.stat()
+    except FileNotFoundError:
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+
+    with _INDEX_LOCK:
+        if _KNOWLEDGE_INDEX is not None and _KNOWLEDGE_INDEX.source_key == key:
+            return _KNOWLEDGE_INDEX
+        try:
+            index = KnowledgeIndex.load()
+            if index.source_key == key:
+                _KNOWLEDGE_INDEX = index
+                return index
+        except Exception:
+            pass
+        return _rebuild_knowledge_index()
+
 def semantic_search_tool(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """TF-IDF semantic search."""
-    query = payload.get("query", "")
+    """TF-IDF semantic search.
+
+    Searches the given `documents`, or the persistent knowledge index
+    (hits carry the source `url`) when none are passed.
+    """
+    query = payload.get("query") or ""
     documents = payload.get("documents", [])
     top_k = int(payload.get("top_k", 5))
 
-    if not documents:
-        return []
+    if not query.strip():
+        # Nothing to vectorize: keep the input order, all scores 0
+        return [{"index": i, "score": 0.0} for i in range(min(top_k, len(documents)))]
 
     try:
-        vectorizer = TfidfVectorizer(stop_words="english", max_features=10000, ngram_range=(1, 2))
-        doc_vecs = vectorizer.fit_transform(documents)
-        qv = vectorizer.transform([query])
-        scores = (doc_vecs @ qv.T).toarray()[:, 0]
-        idxs = np.argsort(-scores)
-        return [{"index": int(i), "score": float(scores[i])} for i in idxs[:top_k]]
+        if not documents:
+            index = _knowledge_index()
+            return index.search(query, top_k) if index is not None else []
+
+        vectorizer, doc_vecs = _fit_corpus(tuple(documents))
+        return [{"index": i, "score": score} for i, score in _top_k(vectorizer, doc_vecs, query, top_k)]
     except Exception as e:
         return [{"error": str(e)}]
 
@@ -87,6 +350,32 @@ def get_knowledge_tool(_: Dict[str, Any] = None) -> Dict[str, Any]:
     data = _read_json(KNOWLEDGE_FILE)
     return data if isinstance(data, dict) else {}
 
+# Max chars of each summary shown to the router
+_CONTEXT_SUMMARY_CHARS = 200
+# ((st_mtime_ns, st_size) of knowledge.json, router context built from it)
+_KNOWLEDGE_CONTEXT_CACHE: Tuple[Optional[Tuple[int, int]], str] = (None, "")
+
+def _context_line(url: str, summary: str) -> str:
+    s = (summary or "").replace("\n", " ")
+    return f"- {url}: {s[:_CONTEXT_SUMMARY_CHARS]}{'...' if len(s) > _CONTEXT_SUMMARY_CHARS else ''}"
+
+def get_knowledge_context() -> str:
+    """One truncated line per knowledge entry, rebuilt only when knowledge.json changes."""
+    global _KNOWLEDGE_CONTEXT_CACHE
+    try:
+        st = KNOWLEDGE_FILE.stat()
+        key = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        key = None
+    if key is not None and _KNOWLEDGE_CONTEXT_CACHE[0] == key:
+        return _KNOWLEDGE_CONTEXT_CACHE[1]
+
+    knowledge = get_knowledge_tool()
+    context = "\n".join(_context_line(url, summary) for url, summary in knowledge.items())
+    context = context or "(no knowledge entries)"
+    _KNOWLEDGE_CONTEXT_CACHE = (key, context)
+    return context
+
 def add_knowledge_url_tool(payload: Dict[str, Any]) -> Dict[str, Any]:
     """Fetch and summarize a webpage, then add to knowledge.json."""
     url = payload.get("url")
@@ -95,21 +384,54 @@ def add_knowledge_url_tool(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     res = fetch_webpage_tool({"urls": [url]})
     content = res.get("content", "")
-    sents = re.split(r'(?<=[.!?])\s+', content)
+    sents = _SENT_SPLIT_RE.split(content)
     summary = " ".join(sents[:3]).strip()
 
     data = _read_json(KNOWLEDGE_FILE)
     data[url] = summary
-    _write_json(KNOWLEDGE_FILE, data)
+    # The knowledge index notices the new mtime/size and rebuilds on its next query
+    _write_json(KNOWLEDGE_FILE, data, pretty=True)
     return {url: summary}
 
-def get_user_profile_tool(payload: Dict[str, Any]) -> Dict[str, Any]:
-    user_id = payload.get("user_id")
+# (parsed users.json object it was built from, user_id -> user)
+_USERS_INDEX: Tuple[Any, Dict[str, Dict[str, Any]]] = (None, {})
+
+def _users_by_id() -> Dict[str, Dict[str, Any]]:
+    """user_id index, rebuilt only when _read_json hands back a fresh users.json parse."""
+    global _USERS_INDEX
     data = _read_json(USERS_FILE)
-    for u in data.get("users", []):
-        if u.get("user_id") == user_id:
-            return u
-    return {"error": "User not found."}
+    if _USERS_INDEX[0] is not data:
+        # reversed() so the first entry wins on duplicate ids, as the old scan did
+        _USERS_INDEX = (data, {u.get("user_id"): u for u in reversed(data.get("users", []))})
+    return _USERS_INDEX[1]
+
+def get_user_profile_tool(payload: Dict[str, Any]) -> Dict[str, Any]:
+    user = _users_by_id().get(payload.get("user_id"))
+    return user if user is not None else {"error": "User not found."}
+
+_LEGACY_TICKETS_IMPORTED = False
+
+def _import_legacy_tickets() -> None:
+    """Copy tickets.json into the NDJSON log once, so old tickets (and their ids) carry over.
+
+    Only runs while the log is still empty; tickets.json is left in place.
+    Caller must hold _APPEND_LOCK.
+    """
+    global _LEGACY_TICKETS_IMPORTED
+    if _LEGACY_TICKETS_IMPORTED:
+        return
+    if _ndjson_count(TICKETS_FILE) == 0 and LEGACY_TICKETS_FILE.exists():
+        try:
+            tickets = orjson.loads(LEGACY_TICKETS_FILE.read_bytes()).get("tickets", [])
+        except Exception as e:
+            # Leave the flag unset so the import is retried once the file is fixed
+            print(f"Error importing {LEGACY_TICKETS_FILE.name}: {e}")
+            return
+        if tickets:
+            with TICKETS_FILE.open("ab") as f:
+                f.write(b"".join(orjson.dumps(t) + b"\n" for t in tickets))
+            print(f"Imported {len(tickets)} tickets from {LEGACY_TICKETS_FILE.name}")
+    _LEGACY_TICKETS_IMPORTED = True
 
 def create_support_ticket_tool(payload: Dict[str, Any]) -> Dict[str, Any]:
     user_id = payload.get("user_id")
@@ -119,19 +441,18 @@ def create_support_ticket_tool(payload: Dict[str, Any]) -> Dict[str, Any]:
     if not all([user_id, subject, body]):
         return {"error": "Missing fields (user_id, subject, body)"}
 
-    tickets_data = _read_json(TICKETS_FILE)
-    tickets = tickets_data.get("tickets", [])
-    ticket_id = f"T{len(tickets)+1:06d}"
-    ticket = {
-        "ticket_id": ticket_id,
-        "user_id": user_id,
-        "subject": subject,
-        "body": body,
-        "status": "open"
-    }
-    tickets.append(ticket)
-    tickets_data["tickets"] = tickets
-    _write_json(TICKETS_FILE, tickets_data)
+    # Lock so concurrent tool threads can't hand out the same sequential id
+    with _APPEND_LOCK:
+        _import_legacy_tickets()
+        ticket_id = f"T{_ndjson_count(TICKETS_FILE)+1:06d}"
+        ticket = {
+            "ticket_id": ticket_id,
+            "user_id": user_id,
+            "subject": subject,
+            "body": body,
+            "status": "open"
+        }
+        _append_ndjson(TICKETS_FILE, ticket)
     return ticket
 
 # ---------------------------
@@ -146,6 +467,22 @@ MCP_TOOLS = {
     "create_support_ticket": create_support_ticket_tool,
 }
 
+# GeminiAgent único do processo: um só cliente SDK (e pool HTTP) para todas as tools
+_GEMINI_SINGLETON: Optional[GeminiAgent] = None
+
+
+def get_gemini() -> GeminiAgent:
+    global _GEMINI_SINGLETON
+    if _GEMINI_SINGLETON is None:
+        _GEMINI_SINGLETON = GeminiAgent()
+    return _GEMINI_SINGLETON
+
+
+# Takes the getter, not an instance: the agent reads GEMINI_* from the environment,
+# which main.py only loads (.env) after importing this module
+GEMINI_BATCHER = PromptBatcher(get_gemini)
+
+
 # =====================================================
 # TOOL 1: gemini_generate
 # =====================================================
@@ -160,10 +497,8 @@ async def tool_gemini_generate(params: Dict[str, Any]) -> Dict[str, Any]:
     max_tokens = params.get("max_tokens", 300)
 
     try:
-        agent = GeminiAgent()
-
-        # GeminiAgent.generate is synchronous; run it in a thread to avoid blocking
-        resp = await asyncio.to_thread(agent.generate, prompt)
+        # Identical prompts already in flight share one call (and one SDK client)
+        resp = await GEMINI_BATCHER.submit(prompt)
 
         # Normalize response into the GEMINI API-like structure expected by callers
         text = None
@@ -244,8 +579,7 @@ User message:
 {message}
 """
 
-    gemini = GeminiAgent()
-    result = gemini.generate_structured(prompt, LLMDecision)
+    result = await get_gemini().generate_structured(prompt, LLMDecision)
 
     if isinstance(result, BaseModel):
         return {"tool_id": "route_message", "result": result.dict()}
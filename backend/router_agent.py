@@ -1,11 +1,12 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable, Awaitable
 from enum import Enum
 from pydantic import BaseModel
 import json
+import asyncio
 
 from .knowledge_agent import KnowledgeAgent
 from .support_agent import SupportAgent
-from .mcpo_tools import GeminiAgent, get_knowledge_tool
+from .mcpo_tools import GeminiAgent, get_gemini, get_knowledge_context
 from .custom_agent import CustomAgent
 from .mcp_client import MCPClient
 from .models import LLMDecision, FinalAnswer
@@ -39,35 +40,37 @@ Respond ONLY with valid JSON:
         knowledge_agent: KnowledgeAgent,
         support_agent: SupportAgent,
         custom_agent: Optional[CustomAgent] = None,
+        gemini_agent: Optional[GeminiAgent] = None,
     ):
         self.knowledge_agent = knowledge_agent
         self.support_agent = support_agent
         self.custom_agent = custom_agent
-        self.gemini_agent = GeminiAgent()
+        self.gemini_agent = gemini_agent or get_gemini()
+        self.mcp_client = MCPClient()
 
-    async def route_and_respond(self, message: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+    async def route_and_respond(
+        self,
+        message: str,
+        user_id: Optional[str] = None,
+        on_step: Optional[Callable[[str], Awaitable[None]]] = None,
+    ) -> Dict[str, Any]:
+        """Route message through the sub-agents; on_step, if given, is awaited before each dispatch."""
         observations, last_output = [], None
         max_steps = 3
 
         try:
-            knowledge = get_knowledge_tool()
-            parts = []
-            for i, (url, summary) in enumerate(knowledge.items()):
-                s = (summary or "").replace("\n", " ")
-                parts.append(f"- {url}: {s[:200]}{'...' if len(s) > 200 else ''}")
-            knowledge_context = "\n".join(parts) if parts else "(no knowledge entries)"
+            # Cached across requests until knowledge.json changes
+            knowledge_context = await asyncio.to_thread(get_knowledge_context)
         except Exception:
             knowledge_context = "(unable to load knowledge)"
 
-        mcp_client = MCPClient()
-
         for step in range(max_steps):
             prompt_data = {
                 "message": message,
                 "knowledge_context": knowledge_context
             }
 
-            route_response = await mcp_client.invoke_tool("route_message", prompt_data)
+            route_response = await self.mcp_client.invoke_tool("route_message", prompt_data)
 
             route_result = route_response.get("result", {})
 
@@ -81,6 +84,8 @@ Respond ONLY with valid JSON:
                 )
 
             sel = decision.selected_agent.strip().upper()
+            if on_step is not None:
+                await on_step(f"Step {step + 1} via {sel}")
             result = await self._dispatch(sel, message, user_id)
             last_output = result
 
@@ -106,15 +111,13 @@ Respond ONLY with valid JSON:
         if sel == "RETRIEVE":
             return await self.knowledge_agent.answer(message)
 
-        direct = self.gemini_agent.generate(message)
+        direct = await self.gemini_agent.generate(message)
         return {"answer": direct.get("answer") or direct.get("text"), "tools_used": []}
 
     async def _format_final(self, message: str, observations: list, last_output: Dict[str, Any], used_retrieval: bool):
         context = "\n\n".join(observations)
         prompt = self.FORMATTING_PROMPT.format(context=context, initial_answer=message)
-        final = self.gemini_agent.generate(prompt)
-
-        final = self.gemini_agent.generate_structured(prompt, FinalAnswer)
+        final = await self.gemini_agent.generate_structured(prompt, FinalAnswer)
 
         if isinstance(final, FinalAnswer):
             final_text = final.answer
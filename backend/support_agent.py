@@ -1,17 +1,30 @@
+import asyncio
+import re
 from typing import Dict, Any, List, Optional
 from .mcpo_tools import (
     get_user_profile_tool,
     create_support_ticket_tool,
     GeminiAgent,
+    get_gemini,
+)
+
+# Messages mentioning any of these get an automatic support ticket (single scan)
+_ESCALATION_RE = re.compile(r"dispute|chargeback|refund|unauthorized|stolen|missing", re.I)
+
+_SUPPORT_PROMPT = (
+    "You are a customer support assistant for Infinitepay. Use the user context below to answer the user's question. "
+    "If the user appears to report an issue that requires escalation (e.g., disputed charge, missing funds, account suspension), recommend creating a support ticket. "
+    "Keep privacy in mind and avoid revealing sensitive tokens or PII beyond what's necessary.\n\n"
+    "User question: {message}\n\nContext:\n{context}\n\nResponse:"
 )
 
 
 class SupportAgent:
     """Agent that handles customer support inquiries using only MCP tools for data and LLM calls."""
 
-    def __init__(self):
-        # Initialize Gemini agent from mcpo_tools
-        self.gemini = GeminiAgent()
+    def __init__(self, gemini: Optional[GeminiAgent] = None):
+        # Reuse the caller's Gemini agent when provided, else the shared one
+        self.gemini = gemini or get_gemini()
 
     async def handle_inquiry(self, user_id: str, message: str) -> Dict[str, Any]:
         """Process a support request for a user.
@@ -25,41 +38,33 @@ class SupportAgent:
         ticket = None
 
         # Get user profile
-        profile = get_user_profile_tool({"user_id": user_id})
+        profile = await asyncio.to_thread(get_user_profile_tool, {"user_id": user_id})
         if profile and "error" not in profile:
             tools_used.append("get_user_profile")
 
         # Build context from available information
         context_parts: List[str] = []
         if profile and isinstance(profile, dict):
-            context_parts.append("User Profile:\n" + "\n".join([f"{k}: {v}" for k, v in profile.items() if k != 'transactions']))
+            context_parts.append("User Profile:\n" + "\n".join(f"{k}: {v}" for k, v in profile.items() if k != 'transactions'))
 
         context = "\n\n".join(context_parts) if context_parts else "No user-specific context available."
 
         # Generate response using Gemini
-        prompt = (
-            "You are a customer support assistant for Infinitepay. Use the user context below to answer the user's question. "
-            "If the user appears to report an issue that requires escalation (e.g., disputed charge, missing funds, account suspension), recommend creating a support ticket. "
-            "Keep privacy in mind and avoid revealing sensitive tokens or PII beyond what's necessary.\n\n"
-            f"User question: {message}\n\nContext:\n{context}\n\nResponse:" 
-        )
-        
-        gen_response = await self.gemini.tool_gemini_generate({"prompt": prompt, "max_tokens": 300})
+        prompt = _SUPPORT_PROMPT.format(message=message, context=context)
+
+        gen_response = await self.gemini.generate(prompt)
         answer_text = ""
-        if isinstance(gen_response, dict) and "result" in gen_response:
-            result = gen_response["result"]
-            if isinstance(result, dict) and "candidates" in result:
-                answer_text = result["candidates"][0]["content"]["parts"][0]["text"]
+        if isinstance(gen_response, dict):
+            answer_text = gen_response.get("text") or ""
 
         if not answer_text:
             answer_text = "I apologize, but I was unable to generate a proper response. Please try again."
 
         # Create ticket if needed
-        lower = message.lower()
-        if any(k in lower for k in ("dispute", "chargeback", "refund", "unauthorized", "stolen", "missing")):
+        if _ESCALATION_RE.search(message):
             ticket_subject = f"Support request: {message[:60]}"
             ticket_body = f"Auto-created from support agent. User: {user_id}\nQuestion: {message}\nContext:\n{context}"
-            ticket = create_support_ticket_tool({
+            ticket = await asyncio.to_thread(create_support_ticket_tool, {
                 "user_id": user_id,
                 "subject": ticket_subject,
                 "body": ticket_body
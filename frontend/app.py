@@ -1,9 +1,110 @@
 import streamlit as st
-import requests
 import os
+import functools
+import json
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator
 
-from dotenv import load_dotenv
-load_dotenv()
+# .env is a local-dev convenience; production gets its env from the container
+if os.environ.get("STREAMLIT_ENV") != "prod":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+try:
+    import orjson
+    _dumps, _loads = orjson.dumps, orjson.loads
+except ImportError:  # optional speedup; stdlib json works the same here
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+    _loads = json.loads
+
+
+# One keep-alive session per server process, built on first use so the
+# requests/urllib3 import chain stays off the first paint
+_SESSION = None
+
+
+def _get_session():
+    global _SESSION
+    if _SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.connection import HTTPConnection
+        from urllib3.util.retry import Retry
+
+        class _TunedAdapter(HTTPAdapter):
+            """HTTPAdapter whose sockets also probe idle keep-alive connections.
+
+            urllib3's defaults (which already set TCP_NODELAY) are kept; SO_KEEPALIVE is added.
+            """
+
+            def init_poolmanager(self, *args, **kwargs):
+                kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+                    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+                ]
+                super().init_poolmanager(*args, **kwargs)
+
+        session = requests.Session()
+        adapter = _TunedAdapter(
+            pool_connections=4,
+            pool_maxsize=20,
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504)),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Content-Type": "application/json", "Connection": "keep-alive"})
+        _SESSION = session
+    return _SESSION
+
+
+# Chat messages rendered inline; older history is folded away
+_VISIBLE_TAIL = 40
+
+# (connect, read) seconds: fail fast on an unreachable backend, wait long for the LLM
+_TIMEOUT = (3.05, 300)
+
+# Reconnect attempts (exponential backoff from _WS_BACKOFF seconds) before falling back to SSE
+_WS_RETRIES = 3
+_WS_BACKOFF = 0.25
+# After the retries fail, this session goes straight to SSE for this many seconds
+_WS_COOLDOWN = 300.0
+# Sockets unused for this many seconds are closed (their Streamlit session may be gone)
+_WS_IDLE = 600.0
+
+# An identical (message, user) resubmitted within this many seconds is a double submit
+_DEDUPE_WINDOW = 2.0
+
+# Repaint the streaming answer at most this often (seconds); the last chunk is always shown
+_FLUSH_INTERVAL = 0.05
+
+
+@functools.lru_cache(maxsize=1)
+def _get_config() -> tuple:
+    """(backend base URL without trailing slash, default user id), read from the env once."""
+    return (
+        os.environ.get("BACKEND_URL", "http://localhost:8000").rstrip("/"),
+        os.environ.get("DEFAULT_USER_ID", "user123"),
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def _swarm_url(backend_url: str, path: str = "/swarm") -> str:
+    return backend_url.rstrip("/") + path
+
+
+@functools.lru_cache(maxsize=8)
+def _swarm_ws_url(backend_url: str) -> str:
+    # http://host -> ws://host, https://host -> wss://host
+    return "ws" + _swarm_url(backend_url, "/swarm/ws")[len("http"):]
+
+
+@functools.lru_cache(maxsize=8)
+def _poster(backend_url: str, path: str = "/swarm", stream: bool = False) -> functools.partial:
+    """Session.post with the URL, timeout and streaming mode bound; call it with data= only."""
+    return functools.partial(_get_session().post, _swarm_url(backend_url, path), stream=stream, timeout=_TIMEOUT)
 
 
 def send_message_to_backend(message: str, backend_url: str, user_id: str) -> dict:
@@ -13,84 +114,266 @@ def send_message_to_backend(message: str, backend_url: str, user_id: str) -> dic
     """
     try:
         payload = {"message": message, "user_id": user_id}
-        resp = requests.post(f"{backend_url.rstrip('/')}/swarm", json=payload, timeout=300)
+        resp = _poster(backend_url)(data=_dumps(payload))
         resp.raise_for_status()
-        return resp.json()
+        return _loads(resp.content)
     except Exception as e:
         return {"error": str(e)}
 
 
+def stream_message_from_backend(message: str, backend_url: str, user_id: str) -> Iterator[Dict[str, Any]]:
+    """Stream a message+user_id through the backend /swarm/stream endpoint.
+
+    Yields the server-sent events as dicts: "status" (routing progress),
+    "delta" (answer text), then "done" (sources/used_retrieval/tools_used)
+    or "error". Falls back to the blocking /swarm call when the backend
+    does not stream.
+    """
+    try:
+        payload = {"message": message, "user_id": user_id}
+        with _poster(backend_url, "/swarm/stream", stream=True)(data=_dumps(payload)) as resp:
+            if resp.status_code == 404 or not resp.headers.get("Content-Type", "").startswith("text/event-stream"):
+                result = send_message_to_backend(message, backend_url=backend_url, user_id=user_id)
+                if result.get("error"):
+                    yield {"type": "error", "error": result["error"]}
+                    return
+                yield {"type": "delta", "text": result.get("answer") or result.get("reply") or ""}
+                yield {"type": "done", **result}
+                return
+
+            resp.raise_for_status()
+            # Raw bytes: SSE is UTF-8, whatever charset requests would guess
+            for line in resp.iter_lines():
+                if line.startswith(b"data:"):
+                    yield _loads(line[5:])
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
+
+
+def normalize_sources(raw: Any) -> tuple:
+    """Backend sources as ((title, url), ...); url is "" for plain-text sources."""
+    # each source may be a dict with url/title or a string
+    return tuple(
+        (s.get("title") or s.get("name") or s.get("url") or s.get("source") or "", s.get("url") or s.get("source") or "")
+        if isinstance(s, dict) else (str(s), "")
+        for s in (raw or ())
+    )
+
+
+# cache_data (not cache_resource): the result is a small string, cheap to hand out as a copy.
+# Process-wide and keyed per reply, so bounded to stay flat over the server's lifetime
+@st.cache_data(show_spinner=False, max_entries=256)
+def render_meta(used_retrieval: Any, tools_used: tuple, sources: tuple) -> str:
+    """Markdown for the "Response details" expander, memoized per metadata triple.
+
+    sources must already be normalized (see normalize_sources).
+    """
+    blocks = []
+    if used_retrieval is not None:
+        blocks.append(f"**used_retrieval:** {used_retrieval}")
+    if tools_used:
+        blocks.append(f"**tools_used:** {list(tools_used)}")
+    if sources:
+        blocks.append("**sources:**\n" + "\n".join(f"- [{t}]({u})" if u else f"- {t}" for t, u in sources))
+    return "\n\n".join(blocks)
+
+
+def _render_message(m: Dict[str, Any]) -> None:
+    with st.chat_message(m["role"]):
+        st.write(m["content"])
+        if m.get("meta_md"):
+            with st.expander("Response details"):
+                st.markdown(m["meta_md"])
+
+
+def render_history(messages: list) -> None:
+    """Replay the chat log.
+
+    Only the last _VISIBLE_TAIL messages are shown inline; older ones sit in an expander.
+    """
+    if len(messages) > _VISIBLE_TAIL:
+        with st.expander(f"Earlier ({len(messages) - _VISIBLE_TAIL} messages)"):
+            for m in messages[:-_VISIBLE_TAIL]:
+                _render_message(m)
+        messages = messages[-_VISIBLE_TAIL:]
+    for m in messages:
+        _render_message(m)
+
+
+# Open /swarm/ws sockets: session key -> (socket, last used). Kept here rather than in
+# st.session_state so sockets of sessions that ended (no hook for that) still get reaped
+_WS_SOCKETS: Dict[str, tuple] = {}
+_WS_LOCK = threading.Lock()
+
+
+def _ws_key() -> str:
+    return st.session_state.setdefault("_ws_key", uuid.uuid4().hex)
+
+
+def _close_ws(ws: Any) -> None:
+    try:
+        ws.close()
+    except Exception:
+        pass
+
+
+def _drop_ws() -> None:
+    with _WS_LOCK:
+        entry = _WS_SOCKETS.pop(_ws_key(), None)
+    if entry is not None:
+        _close_ws(entry[0])
+
+
+def _reap_idle_ws() -> None:
+    """Close every socket (of any session) left unused for _WS_IDLE seconds."""
+    now = time.monotonic()
+    with _WS_LOCK:
+        idle = [key for key, (_, used) in _WS_SOCKETS.items() if now - used > _WS_IDLE]
+        stale = [_WS_SOCKETS.pop(key)[0] for key in idle]
+    for ws in stale:
+        _close_ws(ws)
+
+
+def _get_ws(backend_url: str) -> Any:
+    """This session's socket, (re)connected on demand and marked as just used."""
+    key = _ws_key()
+    with _WS_LOCK:
+        entry = _WS_SOCKETS.get(key)
+    ws = entry[0] if entry is not None else None
+    if ws is None:
+        from websockets.sync.client import connect as ws_connect
+        ws = ws_connect(_swarm_ws_url(backend_url), open_timeout=_TIMEOUT[0], ping_interval=20, max_size=2 ** 20)
+    with _WS_LOCK:
+        _WS_SOCKETS[key] = (ws, time.monotonic())
+    return ws
+
+
+def stream_message_over_websocket(message: str, backend_url: str, user_id: str) -> Iterator[Dict[str, Any]]:
+    """Same events as stream_message_from_backend, over this session's persistent /swarm/ws socket.
+
+    The socket is reused across turns. Failing to (re)connect backs off
+    exponentially, then falls back to SSE; the session then skips the
+    websocket for _WS_COOLDOWN seconds instead of paying the retries again.
+    """
+    _reap_idle_ws()
+    if time.monotonic() < st.session_state.get("ws_unavailable_until", 0.0):
+        yield from stream_message_from_backend(message, backend_url=backend_url, user_id=user_id)
+        return
+
+    payload = _dumps({"message": message, "user_id": user_id})
+    for attempt in range(_WS_RETRIES):
+        complete = False
+        try:
+            ws = _get_ws(backend_url)
+            ws.send(payload)
+        except Exception:
+            _drop_ws()
+            if attempt + 1 < _WS_RETRIES:
+                time.sleep(_WS_BACKOFF * 2 ** attempt)
+            continue
+
+        try:
+            while True:
+                event = _loads(ws.recv(timeout=_TIMEOUT[1]))
+                yield event
+                if event.get("type") in ("done", "error"):
+                    complete = True
+                    return
+        except Exception as e:
+            # The message was already sent: report instead of resending it
+            yield {"type": "error", "error": str(e)}
+            return
+        finally:
+            # Abandoned mid-turn (error or script stopped): the rest of this turn's frames
+            # would be read by the next one, so start over with a fresh socket
+            if not complete:
+                _drop_ws()
+
+    st.session_state.ws_unavailable_until = time.monotonic() + _WS_COOLDOWN
+    yield from stream_message_from_backend(message, backend_url=backend_url, user_id=user_id)
+
+
+def _is_duplicate_submit(message: str, user_id: str) -> bool:
+    """True if (message, user_id) was submitted moments ago (Enter held, double click)."""
+    last = st.session_state.get("_last_submit")
+    return last is not None and last[0] == (message, user_id) and time.monotonic() - last[1] < _DEDUPE_WINDOW
+
+
 def main() -> None:
     st.set_page_config(page_title="CloudWalk Chat", page_icon="💬")
     st.title("CloudWalk Chat")
 
-    backend_url = os.environ.get("BACKEND_URL", "http://localhost:8000")
-    default_user = os.environ.get("DEFAULT_USER_ID", "user123")
+    backend_url, default_user = _get_config()
 
-    # Allow user to set a user_id in the sidebar (persisted in session)
-    if "user_id" not in st.session_state:
-        st.session_state.user_id = default_user
+    # Allow user to set a user_id in the sidebar (persisted in session);
+    # the widget owns the "user_id" key, so no read-back assignment is needed
+    st.session_state.setdefault("user_id", default_user)
 
     st.sidebar.header("Settings")
-    st.session_state.user_id = st.sidebar.text_input("User ID", value=st.session_state.user_id)
+    st.sidebar.text_input("User ID", key="user_id")
     st.sidebar.markdown(f"**Backend:** {backend_url}")
 
     if "messages" not in st.session_state:
         st.session_state.messages = [{"role": "assistant", "content": "Ask me anything."}]
 
-    for m in st.session_state.messages:
-        with st.chat_message(m["role"]):
-            st.write(m["content"])
+    render_history(st.session_state.messages)
 
     user_input = st.chat_input(placeholder="Type a message and press Enter")
+    if user_input and _is_duplicate_submit(user_input, st.session_state.user_id):
+        user_input = None
     if user_input:
+        st.session_state._last_submit = ((user_input, st.session_state.user_id), time.monotonic())
         # show user's message
         st.session_state.messages.append({"role": "user", "content": user_input})
         with st.chat_message("user"):
             st.write(user_input)
 
-        # call backend
-        result = send_message_to_backend(user_input, backend_url=backend_url, user_id=st.session_state.user_id)
-
-        if result.get("error"):
-            assistant_text = f"[error] {result['error']}"
-            st.session_state.messages.append({"role": "assistant", "content": assistant_text})
-            with st.chat_message("assistant"):
-                st.write(assistant_text)
-        else:
-            # backend returns fields like: answer, sources, used_retrieval, tools_used
-            answer = result.get("answer") or result.get("reply") or ""
-            sources = result.get("sources") or []
-            tools_used = result.get("tools_used")
-            used_retrieval = result.get("used_retrieval")
-
-            # display assistant answer
-            st.session_state.messages.append({"role": "assistant", "content": answer})
-            with st.chat_message("assistant"):
-                st.write(answer)
-
-            # display metadata below the assistant message
-            meta_lines = []
-            if used_retrieval is not None:
-                meta_lines.append(f"**used_retrieval:** {used_retrieval}")
-            if tools_used:
-                meta_lines.append(f"**tools_used:** {tools_used}")
-            if sources:
-                meta_lines.append("**sources:**")
-                for s in sources:
-                    # each source may be a dict with url/title or a string
-                    if isinstance(s, dict):
-                        url = s.get("url") or s.get("source") or ""
-                        title = s.get("title") or s.get("name") or url
-                        meta_lines.append(f"- [{title}]({url})")
-                    else:
-                        meta_lines.append(f"- {s}")
-
-            if meta_lines:
+        # call backend, rendering the answer as it streams in
+        answer = ""
+        result: Dict[str, Any] = {}
+        with st.chat_message("assistant"):
+            # immediate feedback while the request is in flight
+            placeholder = st.empty()
+            placeholder.markdown("_Thinking..._")
+            last_flush = 0.0
+            for event in stream_message_over_websocket(user_input, backend_url=backend_url, user_id=st.session_state.user_id):
+                kind = event.get("type")
+                if kind == "status":
+                    placeholder.markdown(f"_{event.get('text', '')}..._")
+                elif kind == "delta":
+                    answer += event.get("text") or ""
+                    now = time.monotonic()
+                    if now - last_flush >= _FLUSH_INTERVAL:
+                        placeholder.markdown(answer)
+                        last_flush = now
+                elif kind == "done":
+                    result = event
+                elif kind == "error":
+                    result = {"error": event.get("error") or "unknown error"}
+
+            meta_md = ""
+            if result.get("error"):
+                answer = f"[error] {result['error']}"
+            else:
+                # backend returns fields like: answer, sources, used_retrieval, tools_used
+                # sources are normalized once, when the reply arrives
+                sources = normalize_sources(result.get("sources"))
+                tools_used = result.get("tools_used")
+                used_retrieval = result.get("used_retrieval")
+                # the router always sends a used_retrieval bool; a plain answer
+                # (False, no tools, no sources) gets no details expander
+                if used_retrieval or tools_used or sources:
+                    meta_md = render_meta(used_retrieval, tuple(tools_used or ()), sources)
+
+            # final flush: whatever the throttle held back
+            placeholder.markdown(answer)
+            # metadata below the answer; stored rendered, so replays skip render_meta
+            if meta_md:
                 with st.expander("Response details"):
-                    for line in meta_lines:
-                        st.markdown(line)
+                    st.markdown(meta_md)
+
+        st.session_state.messages.append({"role": "assistant", "content": answer, "meta_md": meta_md})
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()